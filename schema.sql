@@ -8,6 +8,18 @@ CREATE TABLE pft_transactions (
     amount NUMERIC(18, 6),  -- Transaction amount with up to 18 digits and 6 decimal places
     created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),  -- Record creation timestamp
     transaction_timestamp TIMESTAMP WITH TIME ZONE,  -- Timestamp when the transaction occurred
+    memo_kind SMALLINT GENERATED ALWAYS AS (  -- Memo prefix classified once on insert
+        CASE
+            WHEN memo IS NULL THEN NULL
+            WHEN memo LIKE 'REWARD RESPONSE%' THEN 1
+            WHEN memo LIKE 'Corbanu Reward%' THEN 2
+            WHEN memo LIKE 'REQUEST_POST_FIAT%' THEN 3
+            WHEN memo LIKE 'PROPOSED PF%' THEN 4
+            WHEN memo LIKE 'VERIFICATION PROMPT%' THEN 5
+            WHEN memo LIKE 'Initial PFT Grant Post Initiation%' THEN 6
+            ELSE 0
+        END
+    ) STORED,
 
     -- Constraints
     CONSTRAINT pft_transactions_txhash_key UNIQUE (transaction_hash),
@@ -17,3 +29,14 @@ CREATE TABLE pft_transactions (
 -- Indexes
 CREATE UNIQUE INDEX pft_transactions_txhash_key ON pft_transactions (transaction_hash) USING BTREE;
 CREATE UNIQUE INDEX pft_transactions_pkey ON pft_transactions (id) USING BTREE;
+
+-- Supports the daily per-sender range scans in twitterbot.py
+CREATE INDEX pft_tx_ts_from_idx ON pft_transactions (from_address, transaction_timestamp, memo_kind);
+
+-- Paging state of transaction_feed.py, a single row
+CREATE TABLE pft_feed_state (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),  -- Only one state row exists
+    marker JSONB,  -- account_tx marker of an interrupted run, NULL once a run completes
+    ledger_index_min BIGINT,  -- Lower ledger bound of the account_tx query the marker belongs to
+    last_ledger BIGINT  -- Highest ledger index seen so far
+);
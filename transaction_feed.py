@@ -1,12 +1,28 @@
 import requests
 import json
+import orjson
 import os
+import io
+import csv
+import queue
+import contextlib
+import threading
 import base64
 import binascii
 import datetime
+import decimal
 import psycopg2
+import psycopg2.extras
 import boto3
 from botocore.exceptions import ClientError 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# execute_values needs psycopg2 >= 2.7; older versions fall back to mogrify
+try:
+    from psycopg2.extras import execute_values
+except ImportError:
+    execute_values = None
 
 # ------------------------------------------------------------------------------
 # Configuration
@@ -20,6 +36,27 @@ ISSUER_ADDRESS = "rnQUEEg8yyjrwk9FhyXpKavHyCRJM9BDMW"  # Replace with the actual
 # Which account to check transactions for:
 ACCOUNT_TO_CHECK = ISSUER_ADDRESS
 
+# Memos starting with one of these prefixes are stored cut down to the first
+# 64 bytes of the first memo, which skips decoding the rest; any further memos
+# on the transaction are dropped. Reports only classify such memos by prefix
+# (memo_kind), e.g. ("REQUEST_POST_FIAT", "PROPOSED PF", "VERIFICATION PROMPT").
+# Only hex memos are eligible. Empty by default, so full memos are stored.
+PREFIX_ONLY_MEMOS = ()
+
+# Shared HTTP session so paginated account_tx calls reuse one keep-alive
+# TCP/TLS connection instead of handshaking on every page.
+# account_tx is read-only, so retrying the POST is safe.
+SESSION = requests.Session()
+SESSION.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(total=3, backoff_factor=0.3, allowed_methods=frozenset({"POST"})),
+    ),
+)
+
 # ------------------------------------------------------------------------------
 # Get Neon secret from the AWS secret manager
 # ------------------------------------------------------------------------------
@@ -69,15 +106,18 @@ def fetch_account_transactions(account, ledger_index_min, limit=1000, marker=Non
                 "account": account,
                 "ledger_index_min": ledger_index_min,
                 "ledger_index_max": -1,  # no upper limit
-                "limit": limit
+                "limit": limit,
+                "forward": True,  # oldest first, so an interrupted run never leaves gaps below MAX(ledger_index)
+                "binary": False,  # JSON transactions, so nothing needs decoding client-side
             }
         ]
     }
     if marker:
         request_body["params"][0]["marker"] = marker
 
-    response = requests.post(XRPL_RPC_URL, json=request_body, timeout=20)
-    response_json = response.json()
+    response = SESSION.post(XRPL_RPC_URL, json=request_body, timeout=20)
+    # orjson parses the large account_tx pages much faster than the stdlib json
+    response_json = orjson.loads(response.content)
 
     if "result" not in response_json:
         raise Exception(f"Unexpected response: {response_json}")
@@ -87,6 +127,86 @@ def fetch_account_transactions(account, ledger_index_min, limit=1000, marker=Non
     next_marker = result.get("marker", None)
     return txs, next_marker
 
+# How long the fetcher waits on a full queue before re-checking whether
+# the consumer has stopped
+PAGE_PUT_TIMEOUT = 1
+
+def put_page(pages, item, stop):
+    """
+    Put item on the pages queue, giving up once stop is set.
+    Returns False if the consumer stopped before the item could be queued.
+    """
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=PAGE_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def fetch_pages(account, ledger_index_min, pages, stop, marker=None):
+    """
+    Producer for iter_account_transactions(): page through account_tx and put each
+    (transactions, marker) tuple on the pages queue, so the next page is
+    fetched while the previous one is being inserted. A fetch error is put
+    on the queue for the consumer to raise; None always marks the end.
+    Exits as soon as the stop event is set, so a consumer that failed
+    doesn't leave this thread blocked on a full queue.
+    Pass a saved marker to continue an interrupted paging run.
+    """
+    try:
+        while not stop.is_set():
+            txs, marker = fetch_account_transactions(
+                account=account,
+                ledger_index_min=ledger_index_min,
+                marker=marker,
+            )
+            if not put_page(pages, (txs, marker), stop):
+                return
+
+            # Pagination check
+            if not marker:
+                break
+    except Exception as e:
+        put_page(pages, e, stop)
+    finally:
+        put_page(pages, None, stop)
+
+def iter_account_transactions(account, ledger_index_min, marker=None):
+    """
+    Yield (transaction, page_marker) for every account_tx entry of the account,
+    handling pagination internally. page_marker is the marker that fetches the
+    transaction's page again (None for the first page of a fresh run).
+    The next page is fetched in a background thread while this one is consumed;
+    a small bounded queue keeps at most a couple of pages in memory.
+    Close the generator when done early (or on error) to stop the fetcher.
+    """
+    pages = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    fetcher = threading.Thread(
+        target=fetch_pages,
+        args=(account, ledger_index_min, pages, stop, marker),
+        daemon=True,
+    )
+    fetcher.start()
+
+    try:
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                raise page
+            txs, next_marker = page
+            for entry in txs:
+                yield entry, marker
+            marker = next_marker
+
+        fetcher.join()
+    finally:
+        # Runs on normal exit, on error and when the consumer closes us early
+        stop.set()
+
 def is_token_payment(tx, currency_code, issuer):
     """
     Check if a Payment transaction involves the specified token (IOU).
@@ -104,6 +224,21 @@ def is_token_payment(tx, currency_code, issuer):
 # ------------------------------------------------------------------------------
 # Memo decoding
 # ------------------------------------------------------------------------------
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+_BASE64_CHARS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+def _is_hex(encoded_bytes):
+    """
+    Cheap charset check so bytes.fromhex is only called on input it accepts.
+    """
+    return len(encoded_bytes) % 2 == 0 and not encoded_bytes.translate(None, _HEX_DIGITS)
+
+def _is_base64(encoded_bytes):
+    """
+    Cheap charset and length check so base64 decoding is only tried on plausible input.
+    """
+    return len(encoded_bytes) % 4 == 0 and not encoded_bytes.translate(None, _BASE64_CHARS)
+
 def decode_hex_or_base64(encoded_str):
     """
     Attempts to decode a string from hex or base64.
@@ -112,29 +247,50 @@ def decode_hex_or_base64(encoded_str):
     if not encoded_str:
         return ""
 
-    # Try hex decode first
-    try:
-        decoded_bytes = bytes.fromhex(encoded_str)
-        return decoded_bytes.decode('utf-8', errors='replace')
-    except ValueError:
-        pass
-
-    # If that fails, try base64 decode
-    try:
-        decoded_bytes = base64.b64decode(encoded_str)
-        return decoded_bytes.decode('utf-8', errors='replace')
-    except (binascii.Error, ValueError):
-        # If all decoding fails, return the original encoded string
+    # Both encodings are pure ASCII, anything else is returned as-is
+    if not encoded_str.isascii():
         return encoded_str
+    encoded_bytes = encoded_str.encode('ascii')
+
+    # Hex first: XRPL memos are hex in practice, so this is the hot path
+    if _is_hex(encoded_bytes):
+        return bytes.fromhex(encoded_str).decode('utf-8', errors='replace')
+
+    # Otherwise, try base64 decode
+    if _is_base64(encoded_bytes):
+        try:
+            decoded_bytes = base64.b64decode(encoded_bytes, validate=True)
+            return decoded_bytes.decode('utf-8', errors='replace')
+        except binascii.Error:
+            # Misplaced padding
+            pass
+
+    # If all decoding fails, return the original encoded string
+    return encoded_str
 
-def extract_memos(transaction):
+# Hex characters for the first 64 bytes of a memo
+MEMO_PREFIX_CHARS = 128
+
+def extract_memos(transaction, prefix_only=False):
     """
     Extract and decode all memos from a transaction, concatenating into a single string.
+    With prefix_only, only the start of the first memo is decoded, enough to classify it.
+    That shortcut needs the whole first memo to be hex; otherwise None is returned
+    and the caller should decode in full.
     """
     memos = transaction.get("Memos", [])
     if not memos:
         return ""
 
+    if prefix_only:
+        memo_data = memos[0].get("Memo", {}).get("MemoData", "")
+        # Pick the encoding from the whole value, as the full decode would,
+        # so a hex-looking slice of a non-hex memo isn't misread
+        if not memo_data.isascii() or not _is_hex(memo_data.encode('ascii')):
+            return None
+        prefix = bytes.fromhex(memo_data[:MEMO_PREFIX_CHARS])
+        return prefix.decode('utf-8', errors='replace')
+
     decoded_memos = []
     for memo_entry in memos:
         memo = memo_entry.get("Memo", {})
@@ -147,20 +303,8 @@ def extract_memos(transaction):
 # ------------------------------------------------------------------------------
 # Date/Time handling
 # ------------------------------------------------------------------------------
-def ripple_to_unix_time(ripple_time):
-    """
-    Convert Ripple epoch time (seconds since 1/1/2000) to Unix epoch time (seconds since 1/1/1970).
-    Ripple epoch starts at 2000-01-01 00:00:00 UTC,
-    which is 946684800 seconds after Unix epoch start (1970-01-01).
-    """
-    return ripple_time + 946684800
-
-def get_ripple_datetime(ripple_time):
-    """
-    Returns a Python datetime (UTC) from the ripple ledger close time.
-    """
-    unix_ts = ripple_to_unix_time(ripple_time)
-    return datetime.datetime.utcfromtimestamp(unix_ts)
+# Ripple epoch starts at 2000-01-01 00:00:00 UTC; ledger close times are seconds since then
+RIPPLE_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
 
 # ------------------------------------------------------------------------------
 # Database utility
@@ -177,42 +321,163 @@ def get_last_stored_ledger_index(conn):
             return result[0]
         return -1
 
-def insert_transaction(
-    conn, ledger_index, tx_hash, from_address, to_address, memo,
-    amount_int, tx_datetime
-):
+def get_feed_state(conn):
     """
-    Insert into pft_transactions using an ON CONFLICT DO NOTHING approach
-    to avoid duplicates by transaction_hash.
+    Return (marker, ledger_index_min, last_ledger) from pft_feed_state.
+    marker is only set when the previous run stopped mid-paging; it belongs to
+    the account_tx query starting at ledger_index_min. All None if no state is stored.
     """
     with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO pft_transactions (
-                ledger_index,
-                transaction_hash,
-                from_address,
-                to_address,
-                memo,
-                amount,
-                transaction_timestamp
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (transaction_hash) DO NOTHING;
-            """,
-            (
-                ledger_index,
-                tx_hash,
-                from_address,
-                to_address,
-                memo,
-                amount_int,
-                tx_datetime,
-            )
+        cur.execute("SELECT marker, ledger_index_min, last_ledger FROM pft_feed_state WHERE id = 1;")
+        result = cur.fetchone()
+        if result:
+            return result
+        return None, None, None
+
+def save_feed_state(cur, marker, ledger_index_min, last_ledger):
+    """
+    Upsert the paging position into pft_feed_state. Called in the same
+    transaction as the batch's inserts so data and state are committed together.
+    """
+    cur.execute(
+        """
+        INSERT INTO pft_feed_state (id, marker, ledger_index_min, last_ledger)
+        VALUES (1, %s, %s, %s)
+        ON CONFLICT (id) DO UPDATE SET
+            marker = EXCLUDED.marker,
+            ledger_index_min = EXCLUDED.ledger_index_min,
+            last_ledger = EXCLUDED.last_ledger;
+        """,
+        (
+            psycopg2.extras.Json(marker) if marker else None,
+            ledger_index_min,
+            last_ledger,
         )
-    # Not committing yet – let's commit once per batch for efficiency
-    # or at the end of the script. For safer immediate writes, uncomment the next line:
-    # conn.commit()
+    )
+
+# Number of rows main() accumulates before writing and committing them
+BATCH_SIZE = 1000
+
+INSERT_TRANSACTIONS_SQL = """
+    INSERT INTO pft_transactions (
+        ledger_index,
+        transaction_hash,
+        from_address,
+        to_address,
+        memo,
+        amount,
+        transaction_timestamp
+    )
+    VALUES %s
+    ON CONFLICT (transaction_hash) DO NOTHING;
+"""
+
+def insert_transactions(cur, rows):
+    """
+    Insert a batch of up to BATCH_SIZE row tuples into pft_transactions with a
+    single multi-row statement, using ON CONFLICT DO NOTHING to avoid
+    duplicates by transaction_hash.
+    """
+    if not rows:
+        return
+    if execute_values is not None:
+        execute_values(cur, INSERT_TRANSACTIONS_SQL, rows, page_size=BATCH_SIZE)
+        return
+
+    # Fallback: build the multi-VALUES statement ourselves with mogrify
+    values = b",".join(cur.mogrify("(%s,%s,%s,%s,%s,%s,%s)", row) for row in rows)
+    head, tail = INSERT_TRANSACTIONS_SQL.split("%s")
+    cur.execute(head.encode() + values + tail.encode())
+
+# Batches of at least this many rows (or any batch during an initial backfill)
+# go through COPY. Keep it <= BATCH_SIZE so full batches can take the COPY path.
+COPY_THRESHOLD = 1000
+
+def create_staging_table(cur):
+    """
+    Create the session-local staging table used by the COPY fast path.
+    Only the columns we load are included, so the id sequence on
+    pft_transactions is not consumed for staged rows.
+    """
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS pft_staging (
+            ledger_index BIGINT NOT NULL,
+            transaction_hash TEXT NOT NULL,
+            from_address TEXT,
+            to_address TEXT,
+            memo TEXT,
+            amount NUMERIC(18, 6),
+            transaction_timestamp TIMESTAMP WITH TIME ZONE
+        );
+        """
+    )
+
+def copy_transactions(cur, rows):
+    """
+    Bulk load a batch of row tuples with COPY FROM STDIN into pft_staging,
+    then move them into pft_transactions with ON CONFLICT DO NOTHING.
+    Much faster than INSERT for large backfills.
+    """
+    if not rows:
+        return
+
+    # csv.writer takes care of quoting memos containing commas, quotes or newlines.
+    # Missing timestamps are written as empty fields, which COPY reads as NULL.
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+
+    cur.copy_expert(
+        """
+        COPY pft_staging (
+            ledger_index,
+            transaction_hash,
+            from_address,
+            to_address,
+            memo,
+            amount,
+            transaction_timestamp
+        )
+        FROM STDIN WITH (FORMAT CSV, FORCE_NOT_NULL (from_address, to_address, memo))
+        """,
+        buf,
+    )
+    cur.execute(
+        """
+        INSERT INTO pft_transactions (
+            ledger_index,
+            transaction_hash,
+            from_address,
+            to_address,
+            memo,
+            amount,
+            transaction_timestamp
+        )
+        SELECT DISTINCT ON (transaction_hash)
+            ledger_index,
+            transaction_hash,
+            from_address,
+            to_address,
+            memo,
+            amount,
+            transaction_timestamp
+        FROM pft_staging
+        ON CONFLICT (transaction_hash) DO NOTHING;
+        TRUNCATE pft_staging;
+        """
+    )
+
+def write_batch(cur, rows, backfill):
+    """
+    Write a batch of row tuples in bulk. Initial backfills and batches of at
+    least COPY_THRESHOLD rows use the COPY fast path (COPY plus one merge
+    statement), smaller batches a single multi-row INSERT.
+    """
+    if backfill or len(rows) >= COPY_THRESHOLD:
+        copy_transactions(cur, rows)
+    else:
+        insert_transactions(cur, rows)
 
 # ------------------------------------------------------------------------------
 # Main
@@ -223,31 +488,46 @@ def main():
     conn = psycopg2.connect(DB_CONN_STRING)
     conn.autocommit = False
 
-    # 1) Determine where to resume
-    last_ledger_index = get_last_stored_ledger_index(conn)
-    ledger_index_min = last_ledger_index + 1
-    if last_ledger_index == -1:
-        print("Table is empty. Fetching all ledgers (this might be large).")
+    # Don't wait for the WAL flush on each per-batch commit. A server crash can
+    # lose the last few commits, but rows and feed state are lost together and
+    # the next run re-fetches them; ON CONFLICT (transaction_hash) keeps it idempotent.
+    with conn.cursor() as cur:
+        cur.execute("SET synchronous_commit = off;")
+    conn.commit()
+
+    # 1) Determine where to resume: an interrupted run continues from its
+    # saved marker, otherwise from the highest stored ledger. That ledger is
+    # read again because a batch may have been committed halfway through it;
+    # its already stored transactions are skipped by ON CONFLICT.
+    marker, ledger_index_min, last_ledger = get_feed_state(conn)
+    if marker:
+        print(f"Resuming interrupted run from saved marker (ledger_index >= {ledger_index_min})")
     else:
-        print(f"Resuming from ledger_index > {last_ledger_index}")
+        last_ledger_index = get_last_stored_ledger_index(conn)
+        ledger_index_min = max(last_ledger_index, 0)
+        last_ledger = None
+        if last_ledger_index == -1:
+            print("Table is empty. Fetching all ledgers (this might be large).")
+        else:
+            print(f"Resuming from ledger_index >= {last_ledger_index}")
+    backfill = ledger_index_min == 0
 
     # 2) Fetch & filter transactions
     print(f"Fetching transactions for account: {ACCOUNT_TO_CHECK}")
     print(f"Filtering for Payment transactions of token '{CURRENCY_CODE}' from issuer {ISSUER_ADDRESS}\n")
 
-    marker = None
-    highest_ledger_this_run = ledger_index_min
-
-    while True:
-        transactions_batch, marker = fetch_account_transactions(
-            account=ACCOUNT_TO_CHECK,
-            ledger_index_min=ledger_index_min,
-            marker=marker,
-        )
-
-        for entry in transactions_batch:
+    highest_ledger_this_run = max(ledger_index_min, last_ledger or 0)
+    cur = conn.cursor()
+    create_staging_table(cur)
+    batch_rows = []
+
+    # Closing the generator stops its fetcher thread even if a write fails
+    transactions = iter_account_transactions(ACCOUNT_TO_CHECK, ledger_index_min, marker)
+    with contextlib.closing(transactions):
+        # page_marker re-fetches the page of the current transaction, so a batch
+        # flushed in the middle of a page resumes from the start of that page
+        for entry, page_marker in transactions:
             tx = entry.get("tx", {})
-            meta = entry.get("meta", {})
             ledger_index_tx = tx.get("ledger_index", 0)
 
             # Track highest ledger index we see, so we can save it later
@@ -268,42 +548,58 @@ def main():
                     # If it were XRP in drops, but that shouldn’t happen for your IOU
                     value_str = amount
 
-                # Convert value to an integer (BIGINT).
+                # Convert value to an integer (BIGINT) by keeping the integer part of
+                # the decimal string, without a lossy round trip through float.
                 # If your token can have decimals, you may need to scale or switch to numeric.
                 try:
-                    amount_int = int(float(value_str))
-                except ValueError:
+                    if "e" in value_str or "E" in value_str:
+                        # XRPL may use scientific notation, e.g. "1.5e3"
+                        amount_int = int(decimal.Decimal(value_str))
+                    else:
+                        dot = value_str.find(".")
+                        amount_int = int(value_str[:dot] if dot >= 0 else value_str)
+                except (ValueError, decimal.InvalidOperation):
                     amount_int = 0
 
                 ripple_time = tx.get("date")
                 if ripple_time is not None:
-                    tx_datetime = get_ripple_datetime(ripple_time)
+                    # Timezone-aware, so psycopg2 binds it as timestamptz as-is
+                    tx_datetime = RIPPLE_EPOCH + datetime.timedelta(seconds=ripple_time)
                 else:
                     tx_datetime = None  # fallback if somehow missing
 
-                memo_str = extract_memos(tx)
-
-                # Insert into DB with ON CONFLICT DO NOTHING
-                insert_transaction(
-                    conn=conn,
-                    ledger_index=ledger_index_tx,
-                    tx_hash=tx_hash,
-                    from_address=from_addr,
-                    to_address=to_addr,
-                    memo=memo_str,
-                    amount_int=amount_int,
-                    tx_datetime=tx_datetime,
-                )
-
-        # Commit after each batch (optional approach)
-        conn.commit()
-
-        # Pagination check
-        if not marker:
-            break
-
-    # 3) Done. We don’t necessarily need to write the last ledger anywhere,
-    # because the next run will figure it out from the DB.
+                if PREFIX_ONLY_MEMOS:
+                    # Decode the rest only if the prefix isn't one we store cut down
+                    memo_str = extract_memos(tx, prefix_only=True)
+                    if memo_str is None or not memo_str.startswith(PREFIX_ONLY_MEMOS):
+                        memo_str = extract_memos(tx)
+                else:
+                    memo_str = extract_memos(tx)
+
+                batch_rows.append((
+                    ledger_index_tx,
+                    tx_hash,
+                    from_addr,
+                    to_addr,
+                    memo_str,
+                    amount_int,
+                    tx_datetime,
+                ))
+
+            if len(batch_rows) >= BATCH_SIZE:
+                write_batch(cur, batch_rows, backfill)
+                save_feed_state(cur, page_marker, ledger_index_min, highest_ledger_this_run)
+                conn.commit()
+                batch_rows.clear()
+
+    # Write what's left; an empty marker marks the run as complete
+    write_batch(cur, batch_rows, backfill)
+    save_feed_state(cur, None, ledger_index_min, highest_ledger_this_run)
+    conn.commit()
+
+    # 3) Done. The final batch saved an empty marker, so the next run
+    # starts from the highest stored ledger again.
+    cur.close()
     conn.close()
 
     print("Done.")
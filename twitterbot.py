@@ -1,10 +1,29 @@
 import os
 import json
+import bisect
+import datetime
+import itertools
 import boto3
 import tweepy
 import psycopg2
-import psycopg2.extras
 from botocore.exceptions import ClientError
+from zoneinfo import ZoneInfo
+
+# Account that sends task rewards; all daily stats are based on its payments
+REWARD_ADDRESS = 'r4yc85M1hwsegVGZ1pawpZPwj65SVs8PzD'
+
+# The bot reports on "yesterday" in New York time
+REPORT_TIMEZONE = ZoneInfo('America/New_York')
+
+# Column positions in the daily stats row returned by lambda_handler's query
+COL_TASKS_COMPLETED, COL_PFT, COL_INITIATIONS, COL_LEADERBOARD = range(4)
+
+# Positions within each leaderboard entry
+LB_USER, LB_TASKS_COMPLETED, LB_PFT = range(3)
+
+# Twitter's limit, in weighted characters (see twitter_weighted_len)
+TWEET_LIMIT = 280
+TRUNCATION_MARK = "..."
 
 def get_secret(secret_name):
     """
@@ -43,6 +62,78 @@ def get_secret(secret_name):
         decoded_binary_secret = get_secret_value_response['SecretBinary'].decode('utf-8')
         return json.loads(decoded_binary_secret)
 
+def get_yesterday_bounds(now=None):
+    """
+    Compute the UTC start (inclusive) and end (exclusive) of yesterday in the
+    report timezone, so queries can use a plain range on transaction_timestamp.
+
+    Args:
+        now (datetime, optional): Reference time, defaults to the current time.
+
+    Returns:
+        tuple: (start_utc, end_utc) timezone-aware datetimes.
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    today = now.astimezone(REPORT_TIMEZONE).date()
+    yesterday = today - datetime.timedelta(days=1)
+
+    start_local = datetime.datetime.combine(yesterday, datetime.time.min, tzinfo=REPORT_TIMEZONE)
+    end_local = datetime.datetime.combine(today, datetime.time.min, tzinfo=REPORT_TIMEZONE)
+    return start_local.astimezone(datetime.timezone.utc), end_local.astimezone(datetime.timezone.utc)
+
+def twitter_char_weight(char):
+    """
+    Weight of a single character in Twitter's length counting.
+
+    Latin and common punctuation count as 1, everything else (CJK, emoji, ...)
+    counts as 2. Multi-codepoint emoji sequences are over-counted, which only
+    errs on the side of a shorter tweet.
+
+    Args:
+        char (str): A single character.
+
+    Returns:
+        int: 1 or 2.
+    """
+    code_point = ord(char)
+    if (code_point <= 0x10FF
+            or 0x2000 <= code_point <= 0x200D
+            or 0x2010 <= code_point <= 0x201F
+            or 0x2032 <= code_point <= 0x2037):
+        return 1
+    return 2
+
+def twitter_weighted_len(text):
+    """
+    Length of text as counted against the tweet character limit.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: Weighted length.
+    """
+    return sum(map(twitter_char_weight, text))
+
+def truncate_weighted(text, limit):
+    """
+    Cut text so that, with a trailing "...", it fits within limit weighted characters.
+
+    Args:
+        text (str): The text to shorten.
+        limit (int): Maximum weighted length of the result.
+
+    Returns:
+        str: text unchanged if it already fits, otherwise its longest fitting prefix plus "...".
+    """
+    if twitter_weighted_len(text) <= limit:
+        return text
+    # Weighted length of every prefix is increasing, so binary search the cut point
+    prefix_lengths = list(itertools.accumulate(map(twitter_char_weight, text)))
+    cut = bisect.bisect_right(prefix_lengths, limit - len(TRUNCATION_MARK))
+    return text[:cut] + TRUNCATION_MARK
+
 def create_tweet(initiations, tasks_completed, leaderboard_text, pft_sum):
     """
     Construct the tweet content with the provided data.
@@ -56,36 +147,26 @@ def create_tweet(initiations, tasks_completed, leaderboard_text, pft_sum):
     Returns:
         str: The formatted tweet text.
     """
-    tweet = (
+    header = (
         "🚀 Daily PFT Update!\n\n"
         f"✨ {initiations} new initiations yesterday.\n"
         f"✅ {tasks_completed} tasks were completed.\n\n"
         f"🔥 Total PFT for Completed Tasks: {pft_sum}\n\n"
         "🏆 Leaderboard for Yesterday:\n"
-        f"{leaderboard_text}\n\n"
     )
-    
-    # Twitter character limit is 280. Adjust formatting if necessary.
-    if len(tweet) > 280:
+    footer = "\n\n"
+
+    # Only the leaderboard is shortened, whatever room the fixed parts leave is its budget
+    budget = TWEET_LIMIT - twitter_weighted_len(header) - twitter_weighted_len(footer)
+    if twitter_weighted_len(leaderboard_text) > budget:
         print("WARNING: Tweet exceeds 280 characters. Adjusting content.")
-        # Calculate excess length
-        excess_length = len(tweet) - 280
-        buffer = 3  # for "..."
-        truncated_leaderboard_length = len(leaderboard_text) - excess_length - buffer
-        if truncated_leaderboard_length > 0:
-            truncated_leaderboard = leaderboard_text[:truncated_leaderboard_length] + "..."
-            tweet = (
-                "🚀 Daily PFT Update!\n\n"
-                f"✨ {initiations} new initiations yesterday.\n"
-                f"✅ {tasks_completed} tasks were completed.\n\n"
-                f"🔥 Total PFT for Completed Tasks: {pft_sum}\n\n"
-
-            )
-        # Final check
-        if len(tweet) > 280:
-            tweet = tweet[:277] + "..."
-    
-    return tweet
+        if budget >= len(TRUNCATION_MARK):
+            leaderboard_text = truncate_weighted(leaderboard_text, budget)
+        else:
+            leaderboard_text = ""
+
+    # Final check, in case the fixed parts alone are too long
+    return truncate_weighted(header + leaderboard_text + footer, TWEET_LIMIT)
 
 def authenticate_twitter():
     """
@@ -191,7 +272,7 @@ def lambda_handler(event, context):
     # Connect to the Neon database using the connection string
     try:
         conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor = conn.cursor()
     except Exception as e:
         print("ERROR: Could not connect to the Neon database.")
         print(e)
@@ -200,63 +281,52 @@ def lambda_handler(event, context):
             'body': "Database connection error"
         }
 
-    # Define your queries
-    query1 = """
-    SELECT 
-        COUNT(*) AS tasks_completed,
-        ROUND(SUM(amount)) AS pft
-    FROM pft_transactions
-    WHERE (memo LIKE 'REWARD RESPONSE%%' OR memo LIKE 'Corbanu Reward%%')
-      AND (transaction_timestamp AT TIME ZONE 'America/New_York')::date = 
-          ((CURRENT_TIMESTAMP AT TIME ZONE 'America/New_York')::date - INTERVAL '1 day')::date 
-      AND from_address = 'r4yc85M1hwsegVGZ1pawpZPwj65SVs8PzD'
-    """
-
-    query2 = """
+    # Scan yesterday's slice once and compute every statistic from it,
+    # so the whole report is a single round trip to the database.
+    # memo_kind is the generated memo prefix class from schema.sql:
+    # 1 = REWARD RESPONSE, 2 = Corbanu Reward, 0 = no known prefix.
+    query = """
+    WITH day AS (
+        SELECT to_address, memo_kind, amount
+        FROM pft_transactions
+        WHERE from_address = %(address)s
+          AND transaction_timestamp >= %(start)s
+          AND transaction_timestamp < %(end)s
+    ),
+    completed AS (
+        SELECT to_address, amount
+        FROM day
+        WHERE memo_kind IN (1, 2)
+    )
     SELECT
-        LEFT(to_address,4) AS user,
-        COUNT(*) AS tasks_completed,
-        ROUND(SUM(amount)) AS pft
-    FROM pft_transactions
-    WHERE (memo LIKE 'REWARD RESPONSE%%' OR memo LIKE 'Corbanu Reward%%')
-      AND (transaction_timestamp AT TIME ZONE 'America/New_York')::date = 
-          ((CURRENT_TIMESTAMP AT TIME ZONE 'America/New_York')::date - INTERVAL '1 day')::date 
-      AND from_address = 'r4yc85M1hwsegVGZ1pawpZPwj65SVs8PzD'
-    GROUP BY 1
-    ORDER BY pft DESC
-    LIMIT 5
+        (SELECT COUNT(*) FROM completed) AS tasks_completed,
+        (SELECT ROUND(SUM(amount)) FROM completed) AS pft,
+        (SELECT COUNT(*) FROM day WHERE memo_kind = 0) AS initiations,
+        (SELECT json_agg(json_build_array(t.user, t.tasks_completed, t.pft) ORDER BY t.pft DESC)
+         FROM (
+             SELECT
+                 LEFT(to_address,4) AS user,
+                 COUNT(*) AS tasks_completed,
+                 ROUND(SUM(amount)) AS pft
+             FROM completed
+             GROUP BY 1
+             ORDER BY pft DESC
+             LIMIT 5
+         ) t) AS leaderboard
     """
 
-    query3 = """
-    SELECT 
-        COUNT(*) AS initiations
-    FROM pft_transactions
-    WHERE memo NOT LIKE 'REWARD RESPONSE%%'
-      AND memo NOT LIKE 'REQUEST_POST_FIAT%%'
-      AND memo NOT LIKE 'PROPOSED PF%%'
-      AND memo NOT LIKE 'VERIFICATION PROMPT%%'
-      AND memo NOT LIKE 'Corbanu Reward%%'
-      AND memo NOT LIKE 'Initial PFT Grant Post Initiation%%' 
-      AND (transaction_timestamp AT TIME ZONE 'America/New_York')::date = 
-          ((CURRENT_TIMESTAMP AT TIME ZONE 'America/New_York')::date - INTERVAL '1 day')::date  
-      AND from_address = 'r4yc85M1hwsegVGZ1pawpZPwj65SVs8PzD'
-    """
+    # Yesterday's window in New York time, as UTC bounds for the range predicates
+    start_utc, end_utc = get_yesterday_bounds()
+    query_params = {'address': REWARD_ADDRESS, 'start': start_utc, 'end': end_utc}
 
     try:
-        # Execute Query 1
-        cursor.execute(query1)
-        row_q1 = cursor.fetchone()
-        tasks_completed = row_q1["tasks_completed"] if row_q1["tasks_completed"] else 0
-        pft_sum = row_q1["pft"] if row_q1["pft"] else 0
-
-        # Execute Query 2
-        cursor.execute(query2)
-        top_rows = cursor.fetchall()
-
-        # Execute Query 3
-        cursor.execute(query3)
-        row_q3 = cursor.fetchone()
-        initiations = row_q3["initiations"] if row_q3["initiations"] else 0
+        cursor.execute(query, query_params)
+        row = cursor.fetchone()
+        tasks_completed = row[COL_TASKS_COMPLETED] if row[COL_TASKS_COMPLETED] else 0
+        pft_sum = row[COL_PFT] if row[COL_PFT] else 0
+        initiations = row[COL_INITIATIONS] if row[COL_INITIATIONS] else 0
+        # json_agg yields NULL when nobody completed a task yesterday
+        top_rows = row[COL_LEADERBOARD] or []
 
     except Exception as e:
         print("ERROR: Query execution failed.")
@@ -275,9 +345,9 @@ def lambda_handler(event, context):
     leaderboard_lines = []
     rank = 1
     for row in top_rows:
-        to_address = row["user"]
-        tasks = row["tasks_completed"]
-        pft_for_address = row["pft"]
+        to_address = row[LB_USER]
+        tasks = row[LB_TASKS_COMPLETED]
+        pft_for_address = row[LB_PFT]
         # Optionally, format to_address as a Twitter handle if possible
         # Ensure that to_address is a valid Twitter handle or map addresses to handles
         # If to_address is not a Twitter handle, remove '@' or map accordingly